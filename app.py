@@ -1,11 +1,10 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
 import numpy as np
 from datetime import datetime
-from utils import data_manager, FilterManager, ChartManager
+from utils import data_manager, ChartManager
+from config import AppConfig
 
 # ページ設定
 st.set_page_config(
@@ -87,7 +86,7 @@ date_range = st.sidebar.date_input(
 )
 
 # 担当者フィルター
-all_staff = ['全て'] + sorted(df['担当者'].unique().tolist())
+all_staff = ['全て'] + df['担当者'].cat.categories.tolist()
 selected_staff = st.sidebar.selectbox(
     "担当者", 
     all_staff,
@@ -95,7 +94,7 @@ selected_staff = st.sidebar.selectbox(
 )
 
 # 商品フィルター
-all_products = ['全て'] + sorted(df['商品名'].unique().tolist())
+all_products = ['全て'] + df['商品名'].cat.categories.tolist()
 selected_product = st.sidebar.selectbox(
     "商品", 
     all_products,
@@ -103,16 +102,16 @@ selected_product = st.sidebar.selectbox(
 )
 
 # 顧客フィルター
-all_customers = ['全て'] + sorted(df['顧客名'].unique().tolist())
+all_customers = ['全て'] + df['顧客名'].cat.categories.tolist()
 selected_customer = st.sidebar.selectbox(
     "顧客", 
     all_customers,
     help="特定の顧客のデータのみを表示します"
 )
 
-# フィルター適用
-filtered_df = FilterManager.apply_filters(
-    df, date_range, selected_staff, selected_product, selected_customer
+# フィルター適用（同じ条件での再実行時はキャッシュを利用）
+filtered_df = data_manager.filter_data(
+    tuple(date_range), selected_staff, selected_product, selected_customer
 )
 
 # フィルター結果の表示
@@ -132,84 +131,30 @@ st.markdown("---")
 # 年月別売上・粗利グラフ
 st.subheader("📈 年月別売上・粗利推移")
 
+# 集計キューブにも同じフィルターを適用（月次集計・ランキングはキューブから算出）
+filtered_cube = data_manager.filter_data(
+    tuple(date_range), selected_staff, selected_product, selected_customer, use_cube=True
+)
+
 # 月次集計
-monthly_data = filtered_df.groupby('売上年月').agg({
+monthly_data = filtered_cube.groupby('売上年月').agg({
     '売上金額': 'sum',
     '粗利金額': 'sum'
 }).reset_index()
 
 # 昨対比計算
-monthly_data['昨対比_売上'] = monthly_data['売上金額'].pct_change() * 100
-monthly_data['昨対比_粗利'] = monthly_data['粗利金額'].pct_change() * 100
-
-# サブプロット作成
-fig = make_subplots(
-    rows=2, cols=1,
-    subplot_titles=('売上・粗利推移', '昨対比'),
-    vertical_spacing=0.1,
-    row_heights=[0.7, 0.3]
-)
-
-# 売上・粗利グラフ
-fig.add_trace(
-    go.Scatter(
-        x=monthly_data['売上年月'],
-        y=monthly_data['売上金額'],
-        mode='lines+markers',
-        name='売上金額',
-        line=dict(color='#1f77b4', width=3),
-        marker=dict(size=8)
-    ),
-    row=1, col=1
-)
-
-fig.add_trace(
-    go.Scatter(
-        x=monthly_data['売上年月'],
-        y=monthly_data['粗利金額'],
-        mode='lines+markers',
-        name='粗利金額',
-        line=dict(color='#ff7f0e', width=3),
-        marker=dict(size=8)
-    ),
-    row=1, col=1
-)
-
-# 昨対比グラフ
-fig.add_trace(
-    go.Bar(
-        x=monthly_data['売上年月'],
-        y=monthly_data['昨対比_売上'],
-        name='売上昨対比',
-        marker_color='#1f77b4',
-        opacity=0.7
-    ),
-    row=2, col=1
-)
-
-fig.add_trace(
-    go.Bar(
-        x=monthly_data['売上年月'],
-        y=monthly_data['昨対比_粗利'],
-        name='粗利昨対比',
-        marker_color='#ff7f0e',
-        opacity=0.7
-    ),
-    row=2, col=1
-)
-
-# レイアウト設定
-fig.update_layout(
-    height=600,
-    showlegend=True,
-    title_text="売上・粗利の時系列推移",
-    hovermode='x unified'
+monthly_data['昨対比_売上'] = ChartManager.calculate_growth_rate(monthly_data['売上金額'])
+monthly_data['昨対比_粗利'] = ChartManager.calculate_growth_rate(monthly_data['粗利金額'])
+
+# 売上・粗利推移と昨対比のグラフ
+fig = ChartManager.create_trend_figure(
+    monthly_data,
+    state_key='summary_trend_fig',
+    title="売上・粗利の時系列推移",
+    subplot_title='売上・粗利推移',
+    height=600
 )
 
-fig.update_xaxes(title_text="年月", row=2, col=1)
-fig.update_yaxes(title_text="金額 (円)", row=1, col=1)
-fig.update_yaxes(title_text="昨対比 (%)", row=2, col=1)
-
 st.plotly_chart(fig, use_container_width=True)
 
 # 追加分析セクション
@@ -220,30 +165,32 @@ col1, col2 = st.columns(2)
 
 with col1:
     st.markdown("**🏆 売上TOP10商品**")
-    top_products = filtered_df.groupby('商品名')['売上金額'].sum().sort_values(ascending=False).head(10)
+    top_products = filtered_cube.groupby('商品名', observed=True)['売上金額'].sum().nlargest(10)
     top_products_df = pd.DataFrame({
         '商品名': top_products.index,
         '売上金額': top_products.values
     })
-    top_products_df['売上金額'] = top_products_df['売上金額'].apply(ChartManager.format_currency)
+    top_products_df['売上金額'] = top_products_df['売上金額'].map(ChartManager.format_currency)
     st.dataframe(top_products_df, use_container_width=True, hide_index=True)
 
 with col2:
     st.markdown("**👥 売上TOP10担当者**")
-    top_staff = filtered_df.groupby('担当者')['売上金額'].sum().sort_values(ascending=False).head(10)
+    top_staff = filtered_cube.groupby('担当者', observed=True)['売上金額'].sum().nlargest(10)
     top_staff_df = pd.DataFrame({
         '担当者': top_staff.index,
         '売上金額': top_staff.values
     })
-    top_staff_df['売上金額'] = top_staff_df['売上金額'].apply(ChartManager.format_currency)
+    top_staff_df['売上金額'] = top_staff_df['売上金額'].map(ChartManager.format_currency)
     st.dataframe(top_staff_df, use_container_width=True, hide_index=True)
 
 # 詳細データテーブル
 st.markdown("---")
 st.subheader("📋 詳細データ")
 
-# データエクスポート機能
-csv = filtered_df.to_csv(index=False, encoding='utf-8-sig')
+# データエクスポート機能（フィルター条件が変わった時だけCSVを作り直す）
+csv = data_manager.export_csv(
+    filtered_df, (tuple(date_range), selected_staff, selected_product, selected_customer)
+)
 st.download_button(
     label="📥 CSVダウンロード",
     data=csv,
@@ -251,11 +198,7 @@ st.download_button(
     mime="text/csv"
 )
 
-st.dataframe(
-    filtered_df.sort_values('売上年月', ascending=False),
-    use_container_width=True,
-    hide_index=True
-)
+ChartManager.create_detail_table(filtered_df, AppConfig.get_config()['max_records_display'])
 
 # フィルター情報表示
 st.sidebar.markdown("---")
@@ -3,6 +3,13 @@ import streamlit as st
 from typing import Dict, Any, Optional
 import json
 
+# psutilはオプション依存。プロセス情報はモジュール読み込み時に一度だけ取得する
+try:
+    import psutil
+    _PROCESS = psutil.Process()
+except ImportError:
+    _PROCESS = None
+
 class AppConfig:
     """アプリケーション設定管理クラス"""
     
@@ -200,13 +207,10 @@ class PerformanceMonitor:
     
     def get_memory_usage(self) -> str:
         """メモリ使用量を取得"""
-        try:
-            import psutil
-            process = psutil.Process()
-            memory_mb = process.memory_info().rss / 1024 / 1024
-            return f"{memory_mb:.1f} MB"
-        except ImportError:
+        if _PROCESS is None:
             return "N/A"
+        memory_mb = _PROCESS.memory_info().rss / 1024 / 1024
+        return f"{memory_mb:.1f} MB"
     
     def log_performance(self, operation: str):
         """パフォーマンスをログに記録"""
@@ -1,10 +1,16 @@
 import streamlit as st
 import pandas as pd
-import requests
-from datetime import datetime
+import asyncio
+import hashlib
+import json
 import os
-import openai
 import numpy as np
+from utils import data_manager, ConfigManager
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # ページ設定
 st.set_page_config(
@@ -67,185 +73,402 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# データ読み込み関数
-@st.cache_data
-def load_data():
-    df = pd.read_csv('sales_test_data_utf8.csv')
-    df['売上年月'] = pd.to_datetime(df['売上年月'], format='%Y-%m')
-    return df
+# データ読み込み（全ページ共通のキャッシュを利用）
+df = data_manager.load_data()
 
-# データ読み込み
-df = load_data()
+if df.empty:
+    st.error("データの読み込みに失敗しました。CSVファイルが正しい形式で配置されているか確認してください。")
+    st.stop()
 
 # LLM接続設定
 LLM_URL = "https://api.openai.com"
+LLM_MODEL = "gpt-3.5-turbo"
+LLM_PARAMS = {
+    "max_tokens": 1500,  # より長い回答を許可
+    "temperature": 0.3,  # より一貫性のある回答
+    "top_p": 0.9
+}
+# 「すべて分析」で同時に投げるリクエスト数の上限（APIのレート制限に配慮）
+LLM_MAX_CONCURRENCY = 4
+# 回答キャッシュに保持する件数の上限
+LLM_CACHE_MAX_ENTRIES = 256
+# プロンプトに含める直近の会話履歴の件数
+LLM_HISTORY_TURNS = 3
+
+# システムプロンプトの先頭（全リクエストで同一にしてOpenAIのプロンプトキャッシュを効かせる）
+SYSTEM_PROMPT_PREFIX = """あなたは優秀な売上データ分析アシスタントです。以下の指示に従って、正確で洞察に富んだ回答を提供してください：
+
+【会話のルール】
+1. 直前の会話履歴や追加質問の文脈を必ず考慮し、会話が自然につながるように答えてください。
+2. ユーザーの意図や質問の背景を推測し、必要に応じて逆質問や確認も行ってください。
+3. 具体的な数値やデータを根拠に、分かりやすく日本語で回答してください。
+4. 必要に応じて表や箇条書きで整理してください。
+"""
 
-def analyze_data_for_context(filtered_df):
-    """より詳細なデータ分析を行い、AIのコンテキストを強化する"""
-    analysis = {}
-    
-    # 基本統計
-    analysis['basic_stats'] = {
-        'total_records': len(filtered_df),
-        'total_sales': filtered_df['売上金額'].sum(),
-        'total_profit': filtered_df['粗利金額'].sum(),
-        'avg_profit_rate': (filtered_df['粗利金額'].sum() / filtered_df['売上金額'].sum() * 100) if filtered_df['売上金額'].sum() > 0 else 0
-    }
-    
-    # 担当者別分析
-    staff_analysis = filtered_df.groupby('担当者').agg({
-        '売上金額': ['sum', 'mean', 'count'],
-        '粗利金額': ['sum', 'mean']
-    }).round(0)
-    staff_analysis.columns = ['総売上', '平均売上', '取引回数', '総粗利', '平均粗利']
-    staff_analysis['粗利率'] = (staff_analysis['総粗利'] / staff_analysis['総売上'] * 100).round(1)
-    analysis['staff_analysis'] = staff_analysis.sort_values('総売上', ascending=False)
-    
-    # 商品別分析
-    product_analysis = filtered_df.groupby('商品名').agg({
-        '売上金額': ['sum', 'mean', 'count'],
-        '粗利金額': ['sum', 'mean']
-    }).round(0)
-    product_analysis.columns = ['総売上', '平均売上', '取引回数', '総粗利', '平均粗利']
-    product_analysis['粗利率'] = (product_analysis['総粗利'] / product_analysis['総売上'] * 100).round(1)
-    analysis['product_analysis'] = product_analysis.sort_values('総売上', ascending=False)
-    
-    # 月別トレンド分析
+# AI用の集計表に保持する月数
+ANALYSIS_MAX_MONTHS = 24
+# AI用の集計表で幅を縮める列（合計金額は桁あふれを避けてint64のまま）
+ANALYSIS_COMPACT_DTYPES = {
+    '取引回数': 'int32',
+    '取引件数': 'int32',
+    '平均売上': 'float32',
+    '平均粗利': 'float32',
+    '粗利率': 'float32'
+}
+
+def _compact_analysis(frame):
+    """集計表の件数・平均・率の列を狭い型にし、キャッシュに保持するサイズを抑える"""
+    return frame.astype({c: t for c, t in ANALYSIS_COMPACT_DTYPES.items() if c in frame.columns})
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def monthly_trend_for(selected_staff, selected_product):
+    """担当者・商品の条件ごとに全期間の月別集計を作成する（期間の変更は行の切り出しだけで済ませる）"""
+    filtered_df = data_manager.filter_data(None, selected_staff, selected_product)
     monthly_trend = filtered_df.groupby('売上年月').agg({
         '売上金額': 'sum',
         '粗利金額': 'sum',
         '商品名': 'count'
     }).rename(columns={'商品名': '取引件数'})
     monthly_trend['粗利率'] = (monthly_trend['粗利金額'] / monthly_trend['売上金額'] * 100).round(1)
-    analysis['monthly_trend'] = monthly_trend
+    return monthly_trend
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def analyze_data_for_context(date_range, selected_staff, selected_product):
+    """より詳細なデータ分析を行い、AIのコンテキストを強化する（フィルター条件ごとにキャッシュ）"""
+    filtered_df = data_manager.filter_data(date_range, selected_staff, selected_product)
+    
+    # 該当データがなければ集計せずに返す
+    if filtered_df.empty:
+        return {
+            'basic_stats': {'total_records': 0, 'sales_count': 0, 'total_sales': 0, 'total_profit': 0, 'avg_profit_rate': 0},
+            'empty': True
+        }
+    
+    analysis = {'empty': False}
+    
+    # 基本統計（各列を1回だけ合計する。欠損した金額は読み込み時にNaNとして残るため除いて合計・件数を求める）
+    sales = filtered_df['売上金額'].to_numpy()
+    total_sales = int(np.nansum(sales))
+    total_profit = int(np.nansum(filtered_df['粗利金額'].to_numpy()))
+    analysis['basic_stats'] = {
+        'total_records': len(filtered_df),
+        'sales_count': int(np.count_nonzero(~np.isnan(sales))),
+        'total_sales': total_sales,
+        'total_profit': total_profit,
+        'avg_profit_rate': (total_profit / total_sales * 100) if total_sales > 0 else 0
+    }
+    
+    # 担当者別・商品別分析（合計と件数から平均・粗利率を求める）
+    for group_column, key in (('担当者', 'staff_analysis'), ('商品名', 'product_analysis')):
+        totals = data_manager.group_totals(filtered_df, group_column)
+        # 売上金額のある行がないグループは平均をNaNにする（0除算でinfにしない）
+        transactions = totals['取引回数'].where(totals['取引回数'] > 0)
+        group_analysis = pd.DataFrame({
+            '総売上': totals['売上金額'],
+            '平均売上': (totals['売上金額'] / transactions).round(0),
+            '取引回数': totals['取引回数'],
+            '総粗利': totals['粗利金額'],
+            '平均粗利': (totals['粗利金額'] / transactions).round(0)
+        })
+        group_analysis['粗利率'] = (group_analysis['総粗利'] / group_analysis['総売上'] * 100).round(1)
+        analysis[key] = _compact_analysis(group_analysis.sort_values('総売上', ascending=False))
+    
+    # 月別トレンド分析（全期間の月別集計から選択期間を切り出し、直近24か月に絞る）
+    monthly_trend = monthly_trend_for(selected_staff, selected_product)
+    if date_range and len(date_range) == 2:
+        monthly_trend = monthly_trend.loc[pd.Timestamp(date_range[0]):pd.Timestamp(date_range[1])]
+    analysis['monthly_trend'] = _compact_analysis(monthly_trend.tail(ANALYSIS_MAX_MONTHS))
     
     # 顧客別分析（上位10社）
-    customer_analysis = filtered_df.groupby('顧客名').agg({
-        '売上金額': 'sum',
-        '粗利金額': 'sum',
-        '商品名': 'count'
-    }).rename(columns={'商品名': '取引回数'})
+    customer_analysis = data_manager.group_totals(filtered_df, '顧客名')
     customer_analysis['粗利率'] = (customer_analysis['粗利金額'] / customer_analysis['売上金額'] * 100).round(1)
-    analysis['customer_analysis'] = customer_analysis.sort_values('売上金額', ascending=False).head(10)
+    analysis['customer_analysis'] = _compact_analysis(customer_analysis.nlargest(10, '売上金額'))
     
     return analysis
 
-def call_llm_api(prompt, context="", filtered_df=None):
-    """LLM APIを呼び出す関数（会話文脈対応版）"""
+# プロンプトの表で金額として扱わない列
+PROMPT_NON_AMOUNT_COLUMNS = ('粗利率', '取引回数', '取引件数')
+
+def _to_prompt_csv(frame):
+    """集計表をプロンプト用の「|」区切りテキストにする（金額は千円単位の整数、率は小数1桁）"""
+    compact = frame.copy()
+    for column in frame.columns:
+        if column not in PROMPT_NON_AMOUNT_COLUMNS:
+            # 売上金額が欠損した行だけのグループは平均がNaNになるため、欠損を許す整数型にする
+            compact[column] = (frame[column] / 1000).round().astype('Int64')
+    compact = compact.rename(columns={
+        c: f"{c}(千円)" for c in frame.columns if c not in PROMPT_NON_AMOUNT_COLUMNS
+    })
+    return compact.to_csv(sep='|', float_format='%.1f', date_format='%Y-%m')
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def build_system_prompt(context, filters):
+    """固定の指示とデータ分析結果からシステムプロンプトを作成する（フィルター条件ごとにキャッシュ）
+
+    filtersは(期間, 担当者, 商品)のフィルター条件。会話履歴は含めず、
+    同じフィルター条件なら毎回同じ文字列になるようにする。
+    """
+    # フィルターされたデータの詳細分析
+    analysis = analyze_data_for_context(*filters)
+    if analysis['empty']:
+        # 該当データがない場合は空の表を渡さず、その旨だけを伝える
+        data_summary = "売上データの詳細分析:\n現在のフィルター条件に該当するデータはありません。"
+    else:
+        basic_stats = analysis['basic_stats']
+        # 集計結果はJSON・CSVで渡し、表の整形用の空白にトークンを使わない
+        data_summary = "\n".join([
+            "売上データの詳細分析:",
+            "【基本統計】",
+            json.dumps({
+                '総データ件数': int(basic_stats['total_records']),
+                '総売上': int(basic_stats['total_sales']),
+                '総粗利': int(basic_stats['total_profit']),
+                '平均粗利率': round(float(basic_stats['avg_profit_rate']), 1)
+            }, ensure_ascii=False),
+            "【担当者別売上ランキング（上位5名）】",
+            _to_prompt_csv(analysis['staff_analysis'].head()),
+            "【商品別売上ランキング（上位5商品）】",
+            _to_prompt_csv(analysis['product_analysis'].head()),
+            "【月別トレンド（直近12か月）】",
+            _to_prompt_csv(analysis['monthly_trend'].tail(12)),
+            "【主要顧客（上位5社）】",
+            _to_prompt_csv(analysis['customer_analysis'].head())
+        ])
+    
+    # 固定部分 → データ分析結果 → フィルター条件の順に並べ、変わりにくい部分を先頭に置く
+    return f"{SYSTEM_PROMPT_PREFIX}\n{data_summary}\n{context}"
+
+def build_messages(prompt, system_prompt, history=()):
+    """システムプロンプト・直近の会話履歴・今回の質問をAPIに渡すmessagesにまとめる"""
+    return [
+        {"role": "system", "content": system_prompt},
+        *({"role": msg["role"], "content": msg["content"]} for msg in history),
+        {"role": "user", "content": prompt}
+    ]
+
+def recent_history():
+    """プロンプトに含める直近の会話履歴"""
+    return st.session_state.get("messages", [])[-LLM_HISTORY_TURNS:]
+
+@st.cache_data(ttl=30, show_spinner=False)
+def check_llm_health(url):
+    """LLMサーバーの/healthを確認し、ステータスコードを返す（接続できない場合はNone、30秒キャッシュ）"""
+    import requests
+    
     try:
-        # チャット履歴（直近3件）を取得
-        chat_history = []
-        if "messages" in st.session_state:
-            for msg in st.session_state.messages[-3:]:
-                if msg["role"] == "user":
-                    chat_history.append(f"ユーザー: {msg['content']}")
-                else:
-                    chat_history.append(f"AI: {msg['content']}")
-        chat_history_text = "\n".join(chat_history)
-
-        # フィルターされたデータの詳細分析
-        if filtered_df is not None and len(filtered_df) > 0:
-            analysis = analyze_data_for_context(filtered_df)
-            data_summary = f"""
-            売上データの詳細分析:
-            
-            【基本統計】
-            - 総データ件数: {analysis['basic_stats']['total_records']:,}件
-            - 総売上: ¥{analysis['basic_stats']['total_sales']:,}
-            - 総粗利: ¥{analysis['basic_stats']['total_profit']:,}
-            - 平均粗利率: {analysis['basic_stats']['avg_profit_rate']:.1f}%
-            
-            【担当者別売上ランキング（上位5名）】
-            {analysis['staff_analysis'].head().to_string()}
-            
-            【商品別売上ランキング（上位5商品）】
-            {analysis['product_analysis'].head().to_string()}
-            
-            【月別トレンド】
-            {analysis['monthly_trend'].to_string()}
-            
-            【主要顧客（上位5社）】
-            {analysis['customer_analysis'].head().to_string()}
-            """
-        else:
-            # 全データのサマリー
-            data_summary = f"""
-            売上データの概要:
-            - 総データ件数: {len(df):,}件
-            - 期間: {df['売上年月'].min().strftime('%Y-%m')} 〜 {df['売上年月'].max().strftime('%Y-%m')}
-            - 担当者数: {df['担当者'].nunique()}名
-            - 商品数: {df['商品名'].nunique()}種類
-            - 顧客数: {df['顧客名'].nunique()}社
-            - 総売上: ¥{df['売上金額'].sum():,}
-            - 総粗利: ¥{df['粗利金額'].sum():,}
-            - 平均粗利率: {(df['粗利金額'].sum() / df['売上金額'].sum() * 100):.1f}%
-            """
-        
-        # 改善されたシステムプロンプト
-        system_prompt = f"""
-        あなたは優秀な売上データ分析アシスタントです。以下の指示に従って、正確で洞察に富んだ回答を提供してください：
-
-        【会話のルール】
-        1. 直前の会話履歴や追加質問の文脈を必ず考慮し、会話が自然につながるように答えてください。
-        2. ユーザーの意図や質問の背景を推測し、必要に応じて逆質問や確認も行ってください。
-        3. 具体的な数値やデータを根拠に、分かりやすく日本語で回答してください。
-        4. 必要に応じて表や箇条書きで整理してください。
-
-        【会話履歴】
-        {chat_history_text}
-
-        {context}
-        {data_summary}
-        """
+        # 再試行で待たされないよう、再試行なしのセッションで確認する
+        return ConfigManager.get_http_session(retry=False).get(f"{url}/health", timeout=2).status_code
+    except requests.exceptions.RequestException:
+        return None
+
+@st.cache_resource(ttl=3600)
+def get_response_cache():
+    """APIに渡すmessagesごとのLLM回答を全セッションで共有する（1時間で破棄）"""
+    return {}
+
+def _response_cache_key(messages):
+    """messagesのSHA-256を回答キャッシュのキーにする（長いシステムプロンプトをキーとして保持しない）"""
+    return hashlib.sha256(json.dumps(messages, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def _remember_response(key, answer):
+    """回答をキャッシュに保存する（上限を超えたら古いものから捨てる）"""
+    cache = get_response_cache()
+    if len(cache) >= LLM_CACHE_MAX_ENTRIES:
+        cache.pop(next(iter(cache)), None)
+    cache[key] = answer
+
+def _llm_error_message(e):
+    """LLM呼び出し時の例外を利用者向けのメッセージに変換する"""
+    import requests
+    
+    if isinstance(e, requests.exceptions.HTTPError):
+        return f"API接続エラー: {e.response.status_code} - {e.response.text}"
+    if isinstance(e, requests.exceptions.Timeout):
+        return "LLMサーバーからの応答がタイムアウトしました（120秒）。サーバーの処理が重い可能性があります。しばらく待ってから再度お試しください。"
+    if isinstance(e, requests.exceptions.ConnectionError):
+        return "LLMサーバーに接続できません。サーバーが起動しているか、URLが正しいか確認してください。"
+    return f"予期せぬエラーが発生しました: {str(e)}"
+
+def _request_chat_completion(messages, stream=False):
+    """ローカルLLMサーバー（OpenAI互換API）にrequestsでPOSTし、レスポンスを返す"""
+    api_key = os.environ.get("API_KEY")
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {api_key}"
+    }
+    payload = {
+        "messages": messages,
+        "stream": stream,
+        **LLM_PARAMS
+    }
+    # orjsonがあれば、長いシステムプロンプトを含むリクエストを高速にシリアライズする
+    if orjson is not None:
+        body = orjson.dumps(payload)
+    else:
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    response = ConfigManager.get_http_session().post(
+        f"{LLM_URL}/v1/chat/completions",
+        data=body,
+        headers=headers,
+        timeout=120,
+        stream=stream
+    )
+    response.raise_for_status()
+    return response
+
+def _loads(data):
+    """JSONを読み込む（orjsonがあれば使う）"""
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+def _post_chat_completion(messages):
+    """ローカルLLMサーバーに問い合わせ、回答全体を返す"""
+    result = _loads(_request_chat_completion(messages).content)
+    return result.get('choices', [{}])[0].get('message', {}).get('content', '回答を生成できませんでした。')
+
+def _stream_chat_completion(messages):
+    """ローカルLLMサーバーのSSE（data: 行）を読み、回答の断片を届いた順に返す"""
+    with _request_chat_completion(messages, stream=True) as response:
+        for line in response.iter_lines():
+            if not line.startswith(b"data:"):
+                continue
+            data = line[5:].strip()
+            if data == b"[DONE]":
+                break
+            choices = _loads(data).get('choices') or [{}]
+            content = choices[0].get('delta', {}).get('content')
+            if content:
+                yield content
+
+def stream_llm_api(prompt, context, filters, history=(), use_cache=True):
+    """LLM APIを呼び出し、回答を届いた順に返すジェネレーター（st.write_stream用）
+    
+    historyは今回の質問より前の会話履歴。同じ内容のmessagesへの回答はキャッシュから返す
+    （use_cache=Falseなら問い合わせ直し、キャッシュを新しい回答で置き換える）。
+    """
+    try:
+        messages = build_messages(prompt, build_system_prompt(context, filters), history)
+        cache_key = _response_cache_key(messages)
+        cached = get_response_cache().get(cache_key) if use_cache else None
+        if cached is not None:
+            yield cached
+            return
         
-        api_key = os.environ.get("API_KEY")
+        parts = []
         # LLM_URLがOpenAIのAPIエンドポイントの場合のみopenaiパッケージを使う例
         if LLM_URL.startswith("https://api.openai.com"):  # OpenAI公式APIの場合
-            client = openai.OpenAI(api_key=api_key)
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=1500,  # より長い回答を許可
-                temperature=0.3,  # より一貫性のある回答
-                top_p=0.9
+            client = ConfigManager.get_openai_client(os.environ.get("API_KEY"))
+            stream = client.chat.completions.create(
+                model=LLM_MODEL,
+                messages=messages,
+                stream=True,
+                **LLM_PARAMS
             )
-            return response.choices[0].message.content
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    yield parts[-1]
         else:
-            # ローカルLLMサーバー（OpenAI互換API）にはrequestsでPOST
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {api_key}"
-            }
-            payload = {
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": prompt}
-                ],
-                "max_tokens": 1500,
-                "temperature": 0.3,
-                "top_p": 0.9
-            }
-            response = requests.post(
-                f"{LLM_URL}/v1/chat/completions",
-                json=payload,
-                headers=headers,
-                timeout=120
-            )
-            if response.status_code == 200:
-                result = response.json()
-                return result.get('choices', [{}])[0].get('message', {}).get('content', '回答を生成できませんでした。')
-            else:
-                return f"API接続エラー: {response.status_code} - {response.text}"
+            for content in _stream_chat_completion(messages):
+                parts.append(content)
+                yield content
+        
+        # 最後まで受け取れた回答のみキャッシュする
+        _remember_response(cache_key, "".join(parts))
             
-    except requests.exceptions.Timeout:
-        return "LLMサーバーからの応答がタイムアウトしました（120秒）。サーバーの処理が重い可能性があります。しばらく待ってから再度お試しください。"
-    except requests.exceptions.ConnectionError:
-        return "LLMサーバーに接続できません。サーバーが起動しているか、URLが正しいか確認してください。"
     except Exception as e:
-        return f"予期せぬエラーが発生しました: {str(e)}"
+        yield _llm_error_message(e)
+
+async def _call_llm_api_async(messages, client, semaphore):
+    """1件の質問を非同期で問い合わせる（同時実行数はsemaphoreで制限）"""
+    async with semaphore:
+        try:
+            if client is None:
+                answer = await asyncio.to_thread(_post_chat_completion, messages)
+            else:
+                response = await client.chat.completions.create(
+                    model=LLM_MODEL,
+                    messages=messages,
+                    **LLM_PARAMS
+                )
+                answer = response.choices[0].message.content
+            _remember_response(_response_cache_key(messages), answer)
+            return answer
+        except Exception as e:
+            return _llm_error_message(e)
+
+async def run_llm_api_batch(prompts, system_prompt, history=(), use_cache=True, on_answer=None):
+    """複数の質問を並行して問い合わせ、質問と同じ順序で回答を返す（キャッシュ済みの質問は問い合わせない）
+    
+    on_answerを渡すと、回答が届いた順に on_answer(質問の番号, 回答) を呼ぶ。
+    """
+    cache = get_response_cache()
+    batch_messages = [build_messages(p, system_prompt, history) for p in prompts]
+    if use_cache:
+        answers = [cache.get(_response_cache_key(messages)) for messages in batch_messages]
+    else:
+        answers = [None] * len(prompts)
+    if on_answer is not None:
+        for i, answer in enumerate(answers):
+            if answer is not None:
+                on_answer(i, answer)
+    pending = [i for i, answer in enumerate(answers) if answer is None]
+    if not pending:
+        return answers
+    
+    semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    
+    async def ask(i, client):
+        return i, await _call_llm_api_async(batch_messages[i], client, semaphore)
+    
+    async def collect(client):
+        for next_answer in asyncio.as_completed([ask(i, client) for i in pending]):
+            i, answers[i] = await next_answer
+            if on_answer is not None:
+                on_answer(i, answers[i])
+    
+    if LLM_URL.startswith("https://api.openai.com"):
+        import openai
+        
+        async with openai.AsyncOpenAI(api_key=os.environ.get("API_KEY")) as client:
+            await collect(client)
+    else:
+        await collect(None)
+    
+    return answers
+
+# 分析タイプごとのクイック質問（ボタン表示名, 質問文）
+ANALYSIS_QUESTIONS = {
+    "基本分析": [
+        ("📈 売上トレンドを分析して", "現在の期間での売上トレンドを詳細に分析し、月別の変化、成長している商品や担当者、そしてその要因を具体的な数値と共に教えてください。"),
+        ("👥 担当者別パフォーマンス", "担当者別の売上パフォーマンスを包括的に分析し、最も優秀な担当者の特徴、各担当者の強みと弱み、そして改善点を具体的な数値と共に教えてください。"),
+        ("📦 商品別分析", "商品別の売上分析を行い、最も売上が良い商品と粗利率の高い商品を特定し、商品の特徴、顧客層、そして今後の戦略を具体的な数値と共に教えてください。"),
+        ("💰 収益性分析", "全体的な収益性を詳細に分析し、粗利率の改善点、コスト効率、そして具体的な改善提案を数値データと共に教えてください。"),
+    ],
+    "詳細トレンド分析": [
+        ("📊 月別詳細トレンド", "月別の売上・粗利・取引件数の詳細なトレンド分析を行い、季節性、成長パターン、異常値の特定とその要因を教えてください。"),
+        ("🎯 顧客購買パターン", "顧客の購買パターンを分析し、重要顧客の特徴、購買頻度、商品選択の傾向、そして顧客セグメンテーションを教えてください。"),
+        ("📈 成長率分析", "売上・粗利・取引件数の成長率を計算し、最も成長している分野、停滞している分野、そしてその要因を分析してください。"),
+        ("🔄 相関分析", "売上金額、粗利金額、取引件数、担当者、商品の相関関係を分析し、どの要素が売上に最も影響しているかを教えてください。"),
+    ],
+    "パフォーマンス比較": [
+        ("🏆 担当者ランキング", "担当者を売上、粗利、取引件数、粗利率でランキングし、各担当者の強みと改善点を詳細に分析してください。"),
+        ("📦 商品ランキング", "商品を売上、粗利、取引件数、粗利率でランキングし、各商品の市場ポジションと戦略的価値を分析してください。"),
+        ("👥 担当者効率性", "担当者の効率性（売上/取引件数、粗利/取引件数）を分析し、最も効率的な担当者とその成功要因を教えてください。"),
+        ("📊 商品効率性", "商品の効率性（売上/取引件数、粗利/取引件数）を分析し、最も効率的な商品とその特徴を教えてください。"),
+    ],
+    "予測分析": [
+        ("🔮 売上予測", "現在のトレンドを基に、今後の売上予測を行い、成長が期待できる分野とリスク要因を分析してください。"),
+        ("📈 成長機会", "データから成長機会を特定し、どの商品・担当者・顧客セグメントに投資すべきかを分析してください。"),
+        ("⚠️ リスク分析", "売上データからリスク要因を特定し、どの分野で売上が減少する可能性があるかを分析してください。"),
+        ("🎯 最適化提案", "現在のリソース配分を最適化し、売上と粗利を最大化するための具体的な戦略を提案してください。"),
+    ],
+    "改善提案": [
+        ("💡 売上改善策", "売上を改善するための具体的な施策を、データに基づいて優先度順に提案してください。"),
+        ("📊 粗利率改善", "粗利率を改善するための具体的な施策を、商品・担当者・顧客の観点から提案してください。"),
+        ("👥 担当者育成", "担当者のパフォーマンス向上のための育成プログラムと、ベストプラクティスの共有方法を提案してください。"),
+        ("🎯 戦略的提案", "長期的な成長戦略を、市場分析、競合分析、内部リソースの観点から提案してください。"),
+    ],
+}
 
 # メインページ
 st.markdown('<div class="main-header"><h1>🤖 AIアシスタント</h1><p>売上データの分析とAIによる洞察を提供します</p></div>', unsafe_allow_html=True)
@@ -273,7 +496,7 @@ with st.sidebar:
     )
     
     # 担当者フィルター
-    all_staff = ['全て'] + sorted(df['担当者'].unique().tolist())
+    all_staff = ['全て'] + df['担当者'].cat.categories.tolist()
     selected_staff = st.selectbox(
         "👥 担当者",
         all_staff,
@@ -281,7 +504,7 @@ with st.sidebar:
     )
     
     # 商品フィルター
-    all_products = ['全て'] + sorted(df['商品名'].unique().tolist())
+    all_products = ['全て'] + df['商品名'].cat.categories.tolist()
     selected_product = st.selectbox(
         "📦 商品",
         all_products,
@@ -292,32 +515,27 @@ with st.sidebar:
     # 接続状況表示
     st.markdown('<div class="sidebar-section">', unsafe_allow_html=True)
     st.markdown("### 🔗 LLM接続状況")
-    try:
-        response = requests.get(f"{LLM_URL}/health", timeout=5)
-        if response.status_code == 200:
+    if LLM_URL.startswith("https://api.openai.com"):
+        # OpenAI公式APIには/healthがないため確認しない
+        st.success("✅ OpenAI APIを使用中")
+    else:
+        status_code = check_llm_health(LLM_URL)
+        if status_code == 200:
             st.success("✅ LLMサーバー接続中")
+        elif status_code is None:
+            st.error("❌ LLMサーバー未接続")
+            st.info("LLMサーバーを起動してください")
         else:
             st.error("❌ LLMサーバーエラー")
-    except:
-        st.error("❌ LLMサーバー未接続")
-        st.info("LLMサーバーを起動してください")
+    use_response_cache = not st.checkbox(
+        "🔄 保存済みの回答を使わない",
+        help="同じ質問・同じ条件でも、保存済みの回答を使わずにAIへ問い合わせ直します"
+    )
     st.markdown('</div>', unsafe_allow_html=True)
 
-# フィルター適用
-filtered_df = df.copy()
-
-if len(date_range) == 2:
-    start_date, end_date = date_range
-    filtered_df = filtered_df[
-        (filtered_df['売上年月'].dt.date >= start_date) &
-        (filtered_df['売上年月'].dt.date <= end_date)
-    ]
-
-if selected_staff != '全て':
-    filtered_df = filtered_df[filtered_df['担当者'] == selected_staff]
-
-if selected_product != '全て':
-    filtered_df = filtered_df[filtered_df['商品名'] == selected_product]
+# フィルター適用（条件は1つのマスクにまとめて1回で抽出し、条件ごとにキャッシュする）
+filters = (tuple(date_range), selected_staff, selected_product)
+filtered_df = data_manager.filter_data(*filters)
 
 # フィルター情報をコンテキストに追加
 filter_context = f"""
@@ -333,48 +551,59 @@ st.markdown('<div class="analysis-section">', unsafe_allow_html=True)
 st.subheader("📊 現在のデータサマリー")
 col1, col2, col3, col4 = st.columns(4)
 
+# 合計はAI用の集計結果（フィルター条件ごとにキャッシュ済み）の基本統計を使う
+analysis = analyze_data_for_context(*filters)
+basic_stats = analysis['basic_stats']
+total_records = basic_stats['total_records']
+sales_count = basic_stats['sales_count']
+total_sales = basic_stats['total_sales']
+total_profit = basic_stats['total_profit']
+
 with col1:
-    total_sales = filtered_df['売上金額'].sum()
     st.markdown(f'<div class="metric-card"><h4>総売上金額</h4><h3>¥{total_sales:,}</h3></div>', unsafe_allow_html=True)
 
 with col2:
-    total_profit = filtered_df['粗利金額'].sum()
     st.markdown(f'<div class="metric-card"><h4>総粗利金額</h4><h3>¥{total_profit:,}</h3></div>', unsafe_allow_html=True)
 
 with col3:
-    profit_rate = (total_profit / total_sales * 100) if total_sales > 0 else 0
+    profit_rate = basic_stats['avg_profit_rate']
     st.markdown(f'<div class="metric-card"><h4>粗利率</h4><h3>{profit_rate:.1f}%</h3></div>', unsafe_allow_html=True)
 
 with col4:
-    avg_sales = filtered_df['売上金額'].mean()
+    # 平均は売上金額のある行だけで求める（mean()と同じ）
+    avg_sales = total_sales / sales_count if sales_count > 0 else 0
     st.markdown(f'<div class="metric-card"><h4>平均売上</h4><h3>¥{avg_sales:,.0f}</h3></div>', unsafe_allow_html=True)
 
-# 追加の統計情報
-if len(filtered_df) > 0:
+# 追加の統計情報（AI用の集計結果は売上の降順に並べ替え済み）
+if total_records > 0:
     st.subheader("📈 詳細統計")
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
-        top_staff = filtered_df.groupby('担当者')['売上金額'].sum().sort_values(ascending=False).head(1)
+        top_staff = analysis['staff_analysis']['総売上'].head(1)
         if not top_staff.empty:
-            st.markdown(f'<div class="metric-card"><h4>売上No.1担当者</h4><h3>{top_staff.index[0]}</h3><p>¥{top_staff.iloc[0]:,}</p></div>', unsafe_allow_html=True)
+            st.markdown(f'<div class="metric-card"><h4>売上No.1担当者</h4><h3>{top_staff.index[0]}</h3><p>¥{top_staff.iloc[0]:,.0f}</p></div>', unsafe_allow_html=True)
     
     with col2:
-        top_product = filtered_df.groupby('商品名')['売上金額'].sum().sort_values(ascending=False).head(1)
+        top_product = analysis['product_analysis']['総売上'].head(1)
         if not top_product.empty:
-            st.markdown(f'<div class="metric-card"><h4>売上No.1商品</h4><h3>{top_product.index[0]}</h3><p>¥{top_product.iloc[0]:,}</p></div>', unsafe_allow_html=True)
+            st.markdown(f'<div class="metric-card"><h4>売上No.1商品</h4><h3>{top_product.index[0]}</h3><p>¥{top_product.iloc[0]:,.0f}</p></div>', unsafe_allow_html=True)
     
     with col3:
-        top_customer = filtered_df.groupby('顧客名')['売上金額'].sum().sort_values(ascending=False).head(1)
+        top_customer = analysis['customer_analysis']['売上金額'].head(1)
         if not top_customer.empty:
-            st.markdown(f'<div class="metric-card"><h4>売上No.1顧客</h4><h3>{top_customer.index[0]}</h3><p>¥{top_customer.iloc[0]:,}</p></div>', unsafe_allow_html=True)
+            st.markdown(f'<div class="metric-card"><h4>売上No.1顧客</h4><h3>{top_customer.index[0]}</h3><p>¥{top_customer.iloc[0]:,.0f}</p></div>', unsafe_allow_html=True)
     
     with col4:
-        best_profit_rate = filtered_df.groupby('商品名').apply(
-            lambda x: (x['粗利金額'].sum() / x['売上金額'].sum() * 100) if x['売上金額'].sum() > 0 else 0
-        ).sort_values(ascending=False).head(1)
-        if not best_profit_rate.empty:
-            st.markdown(f'<div class="metric-card"><h4>最高粗利率商品</h4><h3>{best_profit_rate.index[0]}</h3><p>{best_profit_rate.iloc[0]:.1f}%</p></div>', unsafe_allow_html=True)
+        # 商品別の売上・粗利合計から粗利率をまとめて計算する（売上0の商品は0%）
+        product_totals = analysis['product_analysis']
+        profit_rates = (
+            (product_totals['総粗利'] / product_totals['総売上'] * 100)
+            .where(product_totals['総売上'] > 0, 0)
+        )
+        if not profit_rates.empty:
+            best_product = profit_rates.idxmax()
+            st.markdown(f'<div class="metric-card"><h4>最高粗利率商品</h4><h3>{best_product}</h3><p>{profit_rates[best_product]:.1f}%</p></div>', unsafe_allow_html=True)
 st.markdown('</div>', unsafe_allow_html=True)
 
 # チャットインターフェース
@@ -385,185 +614,73 @@ st.subheader("💬 AIアシスタントに質問")
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
-# チャット履歴の表示
-st.markdown('<div class="chat-container">', unsafe_allow_html=True)
-for message in st.session_state.messages:
-    with st.chat_message(message["role"]):
-        st.markdown(message["content"])
-
-# ユーザー入力
-if prompt := st.chat_input("売上データについて質問してください..."):
-    # ユーザーメッセージを追加
-    st.session_state.messages.append({"role": "user", "content": prompt})
-    with st.chat_message("user"):
-        st.markdown(prompt)
-
-    # AI応答を生成
-    with st.chat_message("assistant"):
-        with st.spinner("AIが回答を生成中..."):
-            response = call_llm_api(prompt, filter_context, filtered_df)
-            st.markdown(response)
-    
-    # AIメッセージを追加
-    st.session_state.messages.append({"role": "assistant", "content": response})
-st.markdown('</div>', unsafe_allow_html=True)
+@st.fragment
+def chat_section(filter_context, filters, use_cache):
+    """チャット履歴と入力欄（質問時はこの部分だけを再実行する）"""
+    # チャット履歴の表示
+    st.markdown('<div class="chat-container">', unsafe_allow_html=True)
+    for message in st.session_state.messages:
+        with st.chat_message(message["role"]):
+            st.markdown(message["content"])
+
+    # ユーザー入力
+    if prompt := st.chat_input("売上データについて質問してください..."):
+        # 今回の質問より前の会話履歴を控えてからユーザーメッセージを追加
+        history = recent_history()
+        st.session_state.messages.append({"role": "user", "content": prompt})
+        with st.chat_message("user"):
+            st.markdown(prompt)
+
+        # AI応答を生成（届いたトークンから順に表示）
+        with st.chat_message("assistant"):
+            response = st.write_stream(stream_llm_api(prompt, filter_context, filters, history, use_cache))
+        
+        # AIメッセージを追加
+        st.session_state.messages.append({"role": "assistant", "content": response})
+    st.markdown('</div>', unsafe_allow_html=True)
+
+chat_section(filter_context, filters, use_response_cache)
 st.markdown('</div>', unsafe_allow_html=True)
 
 # 高度な分析機能
 st.markdown('<div class="analysis-section">', unsafe_allow_html=True)
 st.subheader("🔍 高度な分析機能")
 
-# 分析タイプの選択
-analysis_type = st.selectbox(
-    "分析タイプを選択",
-    ["基本分析", "詳細トレンド分析", "パフォーマンス比較", "予測分析", "改善提案"],
-    help="実行したい分析の種類を選択してください"
-)
-
-if analysis_type == "基本分析":
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        if st.button("📈 売上トレンドを分析して"):
-            with st.spinner("分析中..."):
-                question = "現在の期間での売上トレンドを詳細に分析し、月別の変化、成長している商品や担当者、そしてその要因を具体的な数値と共に教えてください。"
-                response = call_llm_api(question, filter_context, filtered_df)
-                st.info(response)
-        
-        if st.button("👥 担当者別パフォーマンス"):
-            with st.spinner("分析中..."):
-                question = "担当者別の売上パフォーマンスを包括的に分析し、最も優秀な担当者の特徴、各担当者の強みと弱み、そして改善点を具体的な数値と共に教えてください。"
-                response = call_llm_api(question, filter_context, filtered_df)
-                st.info(response)
-
-    with col2:
-        if st.button("📦 商品別分析"):
-            with st.spinner("分析中..."):
-                question = "商品別の売上分析を行い、最も売上が良い商品と粗利率の高い商品を特定し、商品の特徴、顧客層、そして今後の戦略を具体的な数値と共に教えてください。"
-                response = call_llm_api(question, filter_context, filtered_df)
-                st.info(response)
-        
-        if st.button("💰 収益性分析"):
-            with st.spinner("分析中..."):
-                question = "全体的な収益性を詳細に分析し、粗利率の改善点、コスト効率、そして具体的な改善提案を数値データと共に教えてください。"
-                response = call_llm_api(question, filter_context, filtered_df)
-                st.info(response)
-
-elif analysis_type == "詳細トレンド分析":
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        if st.button("📊 月別詳細トレンド"):
-            with st.spinner("分析中..."):
-                question = "月別の売上・粗利・取引件数の詳細なトレンド分析を行い、季節性、成長パターン、異常値の特定とその要因を教えてください。"
-                response = call_llm_api(question, filter_context, filtered_df)
-                st.info(response)
-        
-        if st.button("🎯 顧客購買パターン"):
-            with st.spinner("分析中..."):
-                question = "顧客の購買パターンを分析し、重要顧客の特徴、購買頻度、商品選択の傾向、そして顧客セグメンテーションを教えてください。"
-                response = call_llm_api(question, filter_context, filtered_df)
-                st.info(response)
-
-    with col2:
-        if st.button("📈 成長率分析"):
-            with st.spinner("分析中..."):
-                question = "売上・粗利・取引件数の成長率を計算し、最も成長している分野、停滞している分野、そしてその要因を分析してください。"
-                response = call_llm_api(question, filter_context, filtered_df)
-                st.info(response)
-        
-        if st.button("🔄 相関分析"):
-            with st.spinner("分析中..."):
-                question = "売上金額、粗利金額、取引件数、担当者、商品の相関関係を分析し、どの要素が売上に最も影響しているかを教えてください。"
-                response = call_llm_api(question, filter_context, filtered_df)
-                st.info(response)
-
-elif analysis_type == "パフォーマンス比較":
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        if st.button("🏆 担当者ランキング"):
-            with st.spinner("分析中..."):
-                question = "担当者を売上、粗利、取引件数、粗利率でランキングし、各担当者の強みと改善点を詳細に分析してください。"
-                response = call_llm_api(question, filter_context, filtered_df)
-                st.info(response)
-        
-        if st.button("📦 商品ランキング"):
-            with st.spinner("分析中..."):
-                question = "商品を売上、粗利、取引件数、粗利率でランキングし、各商品の市場ポジションと戦略的価値を分析してください。"
-                response = call_llm_api(question, filter_context, filtered_df)
-                st.info(response)
-
-    with col2:
-        if st.button("👥 担当者効率性"):
-            with st.spinner("分析中..."):
-                question = "担当者の効率性（売上/取引件数、粗利/取引件数）を分析し、最も効率的な担当者とその成功要因を教えてください。"
-                response = call_llm_api(question, filter_context, filtered_df)
-                st.info(response)
-        
-        if st.button("📊 商品効率性"):
-            with st.spinner("分析中..."):
-                question = "商品の効率性（売上/取引件数、粗利/取引件数）を分析し、最も効率的な商品とその特徴を教えてください。"
-                response = call_llm_api(question, filter_context, filtered_df)
-                st.info(response)
-
-elif analysis_type == "予測分析":
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        if st.button("🔮 売上予測"):
-            with st.spinner("分析中..."):
-                question = "現在のトレンドを基に、今後の売上予測を行い、成長が期待できる分野とリスク要因を分析してください。"
-                response = call_llm_api(question, filter_context, filtered_df)
-                st.info(response)
-        
-        if st.button("📈 成長機会"):
-            with st.spinner("分析中..."):
-                question = "データから成長機会を特定し、どの商品・担当者・顧客セグメントに投資すべきかを分析してください。"
-                response = call_llm_api(question, filter_context, filtered_df)
-                st.info(response)
-
-    with col2:
-        if st.button("⚠️ リスク分析"):
-            with st.spinner("分析中..."):
-                question = "売上データからリスク要因を特定し、どの分野で売上が減少する可能性があるかを分析してください。"
-                response = call_llm_api(question, filter_context, filtered_df)
-                st.info(response)
-        
-        if st.button("🎯 最適化提案"):
-            with st.spinner("分析中..."):
-                question = "現在のリソース配分を最適化し、売上と粗利を最大化するための具体的な戦略を提案してください。"
-                response = call_llm_api(question, filter_context, filtered_df)
-                st.info(response)
+@st.fragment
+def analysis_section(filter_context, filters, use_cache):
+    """分析タイプの選択と質問ボタン（操作時はこの部分だけを再実行する）"""
+    # 分析タイプの選択
+    analysis_type = st.selectbox(
+        "分析タイプを選択",
+        list(ANALYSIS_QUESTIONS),
+        help="実行したい分析の種類を選択してください"
+    )
 
-elif analysis_type == "改善提案":
     col1, col2 = st.columns(2)
-    
-    with col1:
-        if st.button("💡 売上改善策"):
-            with st.spinner("分析中..."):
-                question = "売上を改善するための具体的な施策を、データに基づいて優先度順に提案してください。"
-                response = call_llm_api(question, filter_context, filtered_df)
-                st.info(response)
-        
-        if st.button("📊 粗利率改善"):
-            with st.spinner("分析中..."):
-                question = "粗利率を改善するための具体的な施策を、商品・担当者・顧客の観点から提案してください。"
-                response = call_llm_api(question, filter_context, filtered_df)
-                st.info(response)
-
-    with col2:
-        if st.button("👥 担当者育成"):
-            with st.spinner("分析中..."):
-                question = "担当者のパフォーマンス向上のための育成プログラムと、ベストプラクティスの共有方法を提案してください。"
-                response = call_llm_api(question, filter_context, filtered_df)
-                st.info(response)
-        
-        if st.button("🎯 戦略的提案"):
-            with st.spinner("分析中..."):
-                question = "長期的な成長戦略を、市場分析、競合分析、内部リソースの観点から提案してください。"
-                response = call_llm_api(question, filter_context, filtered_df)
-                st.info(response)
+    questions = ANALYSIS_QUESTIONS[analysis_type]
+
+    for i, (label, question) in enumerate(questions):
+        with col1 if i < 2 else col2:
+            if st.button(label):
+                st.write_stream(stream_llm_api(question, filter_context, filters, recent_history(), use_cache))
+
+    # 選択中の分析タイプの質問をまとめて並行実行し、回答が届いたものから表示する
+    if st.button("🚀 すべて分析"):
+        slots = []
+        for label, _ in questions:
+            st.markdown(f"**{label}**")
+            slots.append(st.empty())
+        with st.spinner(f"{analysis_type}の質問を{len(questions)}件まとめて分析中..."):
+            system_prompt = build_system_prompt(filter_context, filters)
+            asyncio.run(run_llm_api_batch(
+                [question for _, question in questions],
+                system_prompt,
+                history=recent_history(),
+                use_cache=use_cache,
+                on_answer=lambda i, answer: slots[i].info(answer)
+            ))
+
+analysis_section(filter_context, filters, use_response_cache)
 st.markdown('</div>', unsafe_allow_html=True)
 
 # チャット履歴管理
@@ -579,11 +696,13 @@ with col1:
 with col2:
     if st.button("📥 分析結果をエクスポート"):
         if st.session_state.messages:
+            from datetime import datetime
+            
             # チャット履歴をテキストファイルとしてダウンロード
-            chat_history = ""
-            for msg in st.session_state.messages:
-                role = "ユーザー" if msg["role"] == "user" else "AI"
-                chat_history += f"【{role}】\n{msg['content']}\n\n"
+            chat_history = "".join(
+                f"【{'ユーザー' if msg['role'] == 'user' else 'AI'}】\n{msg['content']}\n\n"
+                for msg in st.session_state.messages
+            )
             
             st.download_button(
                 label="📄 チャット履歴をダウンロード",
@@ -0,0 +1,47 @@
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+
+from utils import DataManager
+
+HEADER = '売上年月,商品名,担当者,顧客名,売上金額,仕入れ金額,粗利金額\n'
+
+
+class ReadDataTest(unittest.TestCase):
+    """DataManager._read_data のCSV読み込みを検証する"""
+
+    def _read_csv(self, body: str) -> pd.DataFrame:
+        with tempfile.TemporaryDirectory() as tmp:
+            csv_path = os.path.join(tmp, 'sales.csv')
+            with open(csv_path, 'w', encoding='utf-8') as f:
+                f.write(HEADER + body)
+            return DataManager(csv_path)._read_data()
+
+    def test_bad_date_keeps_other_rows(self):
+        df = self._read_csv(
+            '2024-04,商品01,伊藤,株式会社パイ,100,60,40\n'
+            '2024/13,商品01,伊藤,株式会社パイ,200,120,80\n'
+            '2024-05,商品02,佐藤,株式会社ゼータ,300,180,120\n'
+        )
+        self.assertEqual(len(df), 3)
+        self.assertEqual(df['売上年月'].isna().sum(), 1)
+        self.assertEqual(
+            list(df['売上年月'].dropna().dt.strftime('%Y-%m')), ['2024-04', '2024-05']
+        )
+
+    def test_empty_name_is_missing_not_category(self):
+        df = self._read_csv(
+            '2024-04,商品01,伊藤,株式会社パイ,100,60,40\n'
+            '2024-04,,佐藤,"",200,120,80\n'
+        )
+        for col in ['商品名', '顧客名']:
+            self.assertNotIn('', df[col].cat.categories)
+            self.assertEqual(df[col].isna().sum(), 1)
+        totals = DataManager.group_totals(df, '商品名')
+        self.assertEqual(list(totals.index), ['商品01'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,27 +1,131 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pv
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
 from datetime import datetime
+import io
 import os
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 import logging
 
 # ログ設定
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 共有データから切り出したビューへの代入が元データに波及しないようにする
+pd.set_option('mode.copy_on_write', True)
+
+def _growth_rate_loop(v: np.ndarray) -> np.ndarray:
+    """前月比（%）を1パスで計算する（_numba_kernelsでコンパイルして使う）"""
+    out = np.empty_like(v)
+    if v.size > 0:
+        out[0] = np.nan
+    for i in range(1, v.size):
+        out[i] = (v[i] / v[i - 1] - 1.0) * 100.0
+    return out
+
+def _group_totals_loop(codes: np.ndarray, sales: np.ndarray, profit: np.ndarray, n_groups: int):
+    """グループコードごとの売上・粗利の合計と件数を1パスで整数集計する（コード-1の欠損行は除く、_numba_kernelsでコンパイルして使う）"""
+    sales_sum = np.zeros(n_groups, dtype=np.int64)
+    profit_sum = np.zeros(n_groups, dtype=np.int64)
+    counts = np.zeros(n_groups, dtype=np.int64)
+    for i in range(codes.size):
+        g = codes[i]
+        if g < 0:
+            continue
+        sales_sum[g] += sales[i]
+        profit_sum[g] += profit[i]
+        counts[g] += 1
+    return sales_sum, profit_sum, counts
+
+@st.cache_resource(show_spinner=False)
+def _numba_kernels() -> Optional[Dict[str, Any]]:
+    """Numbaカーネルを初めて大きな入力が来たときにコンパイルし、全セッションで共有する（numbaがない場合はNone）
+    
+    numbaの読み込みには時間がかかるため、ページの起動時には読み込まない。
+    """
+    try:
+        from numba import njit
+    except ImportError:
+        return None
+    
+    return {
+        'growth_rate': njit(cache=True, error_model='numpy')(_growth_rate_loop),
+        'group_totals': njit(cache=True)(_group_totals_loop)
+    }
+
 class DataManager:
     """データ管理クラス"""
     
+    # カテゴリ型で保持する文字列列
+    CATEGORY_COLUMNS = ['担当者', '商品名', '顧客名']
+    
+    # この件数以上の整数金額はNumbaカーネルでグループ集計する（numbaがある場合のみ）
+    NUMBA_MIN_ROWS = 100_000
+    
     def __init__(self, csv_path: str = 'sales_test_data_utf8.csv'):
         self.csv_path = csv_path
+        self.parquet_path = os.path.splitext(csv_path)[0] + '.parquet'
         self._df = None
     
-    @st.cache_data
-    def load_data(_self) -> pd.DataFrame:
-        """データを読み込み、キャッシュする"""
+    def _is_parquet_fresh(self) -> bool:
+        """ParquetキャッシュがCSVより新しいかを判定する"""
+        if not os.path.exists(self.parquet_path):
+            return False
+        if not os.path.exists(self.csv_path):
+            return True
+        return os.path.getmtime(self.parquet_path) >= os.path.getmtime(self.csv_path)
+    
+    def _save_parquet(self, df: pd.DataFrame) -> None:
+        """次回起動用にParquetキャッシュを書き出す（失敗しても処理は継続する）
+        
+        一時ファイルに書き終えてから置き換え、書き込み途中のファイルが読まれないようにする。
+        """
+        tmp_path = f"{os.path.splitext(self.parquet_path)[0]}.tmp-{os.getpid()}.parquet"
+        try:
+            df.to_parquet(tmp_path, compression='zstd', index=False)
+            os.replace(tmp_path, self.parquet_path)
+        except Exception as e:
+            logger.warning(f"Parquetキャッシュの保存に失敗しました: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    
+    def load_data(self) -> pd.DataFrame:
+        """データを読み込み、全ページ・全セッションで共有する（読み取り専用として扱う）"""
+        return _load_sales_data(self.csv_path)
+    
+    def _read_data(self) -> pd.DataFrame:
+        """ParquetキャッシュまたはCSVからデータを読み込む（キャッシュは_load_sales_dataで行う）"""
         try:
-            df = pd.read_csv(_self.csv_path)
+            # CSVより新しいParquetキャッシュがあれば、型変換・並べ替え済みのデータをそのまま読み込む
+            if self._is_parquet_fresh():
+                try:
+                    df = pd.read_parquet(self.parquet_path)
+                    logger.info(f"データ読み込み完了（Parquet）: {len(df)}件")
+                    return df
+                except Exception as e:
+                    # 壊れたキャッシュはCSVから読み直して上書きする
+                    logger.warning(f"Parquetキャッシュを読み込めないためCSVから読み込みます: {str(e)}")
+            
+            # PyArrowの列指向CSVリーダーで読み込み
+            # 文字列列は辞書型で読み込み、Pythonの文字列オブジェクトを作らずにカテゴリ型へ変換する
+            # 年月は文字列で読み、不正な値があってもその行だけNaTにする（読み込み全体を失敗させない）
+            # 空欄は空文字のカテゴリにせず欠損として読む（pd.read_csvと同じ扱い）
+            column_types = {'売上年月': pa.string()}
+            column_types.update({col: pa.dictionary(pa.int32(), pa.string()) for col in self.CATEGORY_COLUMNS})
+            table = pv.read_csv(
+                self.csv_path,
+                convert_options=pv.ConvertOptions(
+                    column_types=column_types,
+                    strings_can_be_null=True,
+                    quoted_strings_can_be_null=True
+                )
+            )
+            df = table.to_pandas()
+            df['売上年月'] = pd.to_datetime(df['売上年月'], format='%Y-%m', errors='coerce')
             
             # データ検証
             required_columns = ['売上年月', '商品名', '担当者', '顧客名', '売上金額', '仕入れ金額', '粗利金額']
@@ -30,30 +134,114 @@ class DataManager:
             if missing_columns:
                 raise ValueError(f"必要な列が不足しています: {missing_columns}")
             
-            # データ型変換
-            df['売上年月'] = pd.to_datetime(df['売上年月'], format='%Y-%m', errors='coerce')
-            
             # 数値列の検証
             numeric_columns = ['売上金額', '仕入れ金額', '粗利金額']
             for col in numeric_columns:
                 df[col] = pd.to_numeric(df[col], errors='coerce')
+                # 欠損がなくint32に収まる金額列は幅を縮めてメモリ使用量を半減（集計はint64で行われる）
+                if df[col].notna().all() and df[col].abs().max() < 2**31:
+                    df[col] = df[col].astype('int32')
+            
+            # カテゴリを並べ替え、選択肢の一覧としてそのまま使えるようにする（フィルター・集計は整数コードで処理）
+            for col in self.CATEGORY_COLUMNS:
+                df[col] = df[col].cat.set_categories(sorted(df[col].cat.categories))
+            
+            # 年月順に並べておき、期間フィルターを二分探索で行えるようにする
+            df = df.sort_values('売上年月', kind='stable', ignore_index=True)
             
             # 欠損値の確認
             null_counts = df.isnull().sum()
             if null_counts.any():
                 logger.warning(f"欠損値が検出されました: {null_counts[null_counts > 0]}")
             
+            self._save_parquet(df)
+            
             logger.info(f"データ読み込み完了: {len(df)}件")
             return df
             
         except FileNotFoundError:
-            st.error(f"CSVファイルが見つかりません: {_self.csv_path}")
+            st.error(f"CSVファイルが見つかりません: {self.csv_path}")
             return pd.DataFrame()
         except Exception as e:
             st.error(f"データ読み込みエラー: {str(e)}")
             logger.error(f"データ読み込みエラー: {str(e)}")
             return pd.DataFrame()
     
+    def load_cube(self) -> pd.DataFrame:
+        """年月・担当者・商品・顧客単位の集計キューブを作成し、共有する"""
+        return _load_cube(self.csv_path)
+    
+    def load_monthly(self, group_column: str) -> pd.DataFrame:
+        """指定列×年月単位の月次集計を作成し、共有する（インデックス: (group_column, 売上年月)）"""
+        return _load_monthly(self.csv_path, group_column)
+    
+    def load_partitioned(self, group_column: str) -> tuple:
+        """指定列→年月の順に並べ替えたデータと、値ごとの行範囲（slice）を作成し、共有する
+        
+        値ごとの行は連続した範囲になるため、iloc[行範囲]でコピーせずに切り出せる。
+        """
+        return _load_partitioned(self.csv_path, group_column)
+    
+    def filter_data(self,
+                    date_range: Optional[tuple] = None,
+                    selected_staff: Optional[str] = None,
+                    selected_product: Optional[str] = None,
+                    selected_customer: Optional[str] = None,
+                    use_cube: bool = False) -> pd.DataFrame:
+        """フィルター条件ごとの抽出結果をキャッシュする（共有されるため読み取り専用として扱う）"""
+        return _filter_data(
+            self.csv_path, date_range, selected_staff, selected_product, selected_customer, use_cube
+        )
+    
+    def export_csv(self, df: pd.DataFrame, cache_key: tuple) -> bytes:
+        """CSVエクスポート用のバイト列を作成する（cache_keyが同じ間は再利用）"""
+        return _export_csv(self.csv_path, df, cache_key)
+    
+    @staticmethod
+    def group_totals(df: pd.DataFrame, group_column: str) -> pd.DataFrame:
+        """カテゴリ列ごとの売上・粗利の合計と取引回数を、カテゴリの整数コードに対するbincountで集計する
+        
+        groupbyと同じく該当行のある値だけを返し（observed=True相当）、グループ列が欠損の行は除く。
+        金額の欠損は合計では0として扱い、取引回数は売上金額のある行だけを数える（groupbyのsum/countと同じ）。
+        大きな整数データはNumbaカーネルで3つの集計を1パスにまとめる。
+        """
+        column = df[group_column]
+        categories = column.cat.categories
+        codes = column.cat.codes.to_numpy()
+        n_groups = len(categories)
+        sales = df['売上金額'].to_numpy()
+        profit = df['粗利金額'].to_numpy()
+        
+        # 欠損カテゴリ（コード-1）の行はどのグループにも入れない
+        has_group = codes >= 0
+        if not has_group.all():
+            codes, sales, profit = codes[has_group], sales[has_group], profit[has_group]
+        
+        kernels = None
+        if (codes.size >= DataManager.NUMBA_MIN_ROWS
+                and sales.dtype.kind == 'i' and profit.dtype.kind == 'i'):
+            kernels = _numba_kernels()
+        if kernels is not None:
+            sales_sum, profit_sum, counts = kernels['group_totals'](codes, sales, profit, n_groups)
+            rows = counts
+        else:
+            rows = np.bincount(codes, minlength=n_groups)
+            counts = rows
+            if sales.dtype.kind == 'f':
+                counts = np.bincount(codes[~np.isnan(sales)], minlength=n_groups)
+                sales = np.nan_to_num(sales, nan=0.0)
+            if profit.dtype.kind == 'f':
+                profit = np.nan_to_num(profit, nan=0.0)
+            sales_sum = np.rint(np.bincount(codes, weights=sales, minlength=n_groups)).astype('int64')
+            profit_sum = np.rint(np.bincount(codes, weights=profit, minlength=n_groups)).astype('int64')
+        
+        observed = rows > 0
+        return pd.DataFrame({
+            '売上金額': sales_sum[observed],
+            '粗利金額': profit_sum[observed],
+            '取引回数': counts[observed]
+        }, index=pd.Index(categories[observed], name=group_column))
+    
     def validate_data(self, df: pd.DataFrame) -> Dict[str, Any]:
         """データの品質を検証する"""
         validation_result = {
@@ -81,10 +269,11 @@ class DataManager:
             if df['粗利金額'].min() < 0:
                 validation_result['issues'].append("粗利金額に負の値が含まれています")
             
-            # 粗利率の妥当性チェック
-            calculated_profit = df['売上金額'] - df['仕入れ金額']
-            profit_diff = abs(df['粗利金額'] - calculated_profit)
-            if (profit_diff > 1).any():  # 1円以上の差がある場合
+            # 粗利率の妥当性チェック（int32の桁あふれを避けてfloat64の配列で計算する）
+            sales = df['売上金額'].to_numpy(dtype='float64')
+            cost = df['仕入れ金額'].to_numpy(dtype='float64')
+            profit = df['粗利金額'].to_numpy(dtype='float64')
+            if np.any(np.abs(profit - (sales - cost)) > 1):  # 1円以上の差がある場合
                 validation_result['issues'].append("粗利金額と売上金額-仕入れ金額に不一致があります")
             
             if validation_result['issues']:
@@ -105,55 +294,169 @@ class FilterManager:
                      selected_staff: Optional[str] = None,
                      selected_product: Optional[str] = None,
                      selected_customer: Optional[str] = None) -> pd.DataFrame:
-        """フィルターを適用する"""
-        filtered_df = df.copy()
+        """フィルターを適用する（戻り値は入力とデータを共有する場合があるため、読み取り専用として扱う）"""
+        filtered_df = df
+        mask = None
         
         # 期間フィルター
         if date_range and len(date_range) == 2:
-            start_date, end_date = date_range
-            filtered_df = filtered_df[
-                (filtered_df['売上年月'].dt.date >= start_date) &
-                (filtered_df['売上年月'].dt.date <= end_date)
-            ]
-        
-        # 担当者フィルター
-        if selected_staff and selected_staff != '全て':
-            filtered_df = filtered_df[filtered_df['担当者'] == selected_staff]
+            # datetime64のまま比較する（.dt.dateによる行ごとのdate生成を避ける）
+            start_ts, end_ts = pd.Timestamp(date_range[0]), pd.Timestamp(date_range[1])
+            dates = filtered_df['売上年月']
+            if dates.is_monotonic_increasing:
+                # 年月でソート済みの場合は二分探索で範囲を切り出す
+                start_pos = dates.searchsorted(start_ts, side='left')
+                end_pos = dates.searchsorted(end_ts, side='right')
+                filtered_df = filtered_df.iloc[start_pos:end_pos]
+            else:
+                mask = ((dates >= start_ts) & (dates <= end_ts)).to_numpy()
         
-        # 商品フィルター
-        if selected_product and selected_product != '全て':
-            filtered_df = filtered_df[filtered_df['商品名'] == selected_product]
+        # 担当者・商品・顧客フィルターは1つのマスクにまとめ、抽出は最後に1回だけ行う
+        for column, selected in (('担当者', selected_staff),
+                                 ('商品名', selected_product),
+                                 ('顧客名', selected_customer)):
+            if selected and selected != '全て':
+                condition = (filtered_df[column] == selected).to_numpy()
+                mask = condition if mask is None else mask & condition
         
-        # 顧客フィルター
-        if selected_customer and selected_customer != '全て':
-            filtered_df = filtered_df[filtered_df['顧客名'] == selected_customer]
+        if mask is not None:
+            filtered_df = filtered_df[mask]
         
         return filtered_df
 
 class ChartManager:
     """チャート作成管理クラス"""
     
+    # この件数以上の系列はNumbaカーネルで前月比を計算する（numbaがある場合のみ）
+    NUMBA_MIN_SIZE = 10_000
+    
+    # この点数以上の折れ線はWebGL（Scattergl）で描画する
+    WEBGL_MIN_POINTS = 2_000
+    
     @staticmethod
     def create_kpi_cards(filtered_df: pd.DataFrame) -> None:
         """KPIカードを作成する"""
+        # 合計・平均を1回の集計でまとめて求める
+        stats = filtered_df[['売上金額', '粗利金額']].agg(['sum', 'mean'])
+        total_sales = stats.loc['sum', '売上金額']
+        total_profit = stats.loc['sum', '粗利金額']
+        avg_sales = stats.loc['mean', '売上金額']
+        
         col1, col2, col3, col4 = st.columns(4)
         
         with col1:
-            total_sales = filtered_df['売上金額'].sum()
-            st.metric("総売上金額", f"¥{total_sales:,}")
+            st.metric("総売上金額", f"¥{total_sales:,.0f}")
         
         with col2:
-            total_profit = filtered_df['粗利金額'].sum()
-            st.metric("総粗利金額", f"¥{total_profit:,}")
+            st.metric("総粗利金額", f"¥{total_profit:,.0f}")
         
         with col3:
             profit_rate = (total_profit / total_sales * 100) if total_sales > 0 else 0
             st.metric("粗利率", f"{profit_rate:.1f}%")
         
         with col4:
-            avg_sales = filtered_df['売上金額'].mean()
             st.metric("平均売上", f"¥{avg_sales:,.0f}")
     
+    @staticmethod
+    def calculate_growth_rate(values: pd.Series) -> np.ndarray:
+        """前月比（%）を計算する（先頭はNaN、pct_change() * 100 と同じ結果）"""
+        v = values.to_numpy(dtype=np.float64)
+        if v.size >= ChartManager.NUMBA_MIN_SIZE:
+            kernels = _numba_kernels()
+            if kernels is not None:
+                return kernels['growth_rate'](v)
+        
+        out = np.empty_like(v)
+        out[:1] = np.nan
+        with np.errstate(divide='ignore', invalid='ignore'):
+            out[1:] = (v[1:] / v[:-1] - 1.0) * 100.0
+        return out
+    
+    @staticmethod
+    def create_trend_figure(monthly_data: pd.DataFrame,
+                            state_key: str,
+                            title: str,
+                            subplot_title: str,
+                            height: int) -> go.Figure:
+        """売上・粗利推移と昨対比のグラフを作成する
+        
+        トレース構成は常に同じため、図はセッションごとに一度だけ作成し、
+        2回目以降はデータとタイトルのみ更新する。
+        点数が多い場合は折れ線をWebGLで描画し、その切り替え時のみ図を作り直す。
+        """
+        use_webgl = len(monthly_data) >= ChartManager.WEBGL_MIN_POINTS
+        
+        fig = st.session_state.get(state_key)
+        if fig is None or (fig.data[0].type == 'scattergl') != use_webgl:
+            line_trace = go.Scattergl if use_webgl else go.Scatter
+            fig = make_subplots(
+                rows=2, cols=1,
+                subplot_titles=(subplot_title, '昨対比'),
+                vertical_spacing=0.1,
+                row_heights=[0.7, 0.3]
+            )
+            
+            # 売上・粗利グラフ
+            fig.add_trace(
+                line_trace(
+                    mode='lines+markers',
+                    name='売上金額',
+                    line=dict(color='#1f77b4', width=3),
+                    marker=dict(size=8)
+                ),
+                row=1, col=1
+            )
+            fig.add_trace(
+                line_trace(
+                    mode='lines+markers',
+                    name='粗利金額',
+                    line=dict(color='#ff7f0e', width=3),
+                    marker=dict(size=8)
+                ),
+                row=1, col=1
+            )
+            
+            # 昨対比グラフ
+            fig.add_trace(
+                go.Bar(
+                    name='売上昨対比',
+                    marker_color='#1f77b4',
+                    opacity=0.7
+                ),
+                row=2, col=1
+            )
+            fig.add_trace(
+                go.Bar(
+                    name='粗利昨対比',
+                    marker_color='#ff7f0e',
+                    opacity=0.7
+                ),
+                row=2, col=1
+            )
+            
+            # レイアウト設定
+            fig.update_layout(
+                height=height,
+                showlegend=True,
+                hovermode='x unified'
+            )
+            fig.update_xaxes(title_text="年月", row=2, col=1)
+            fig.update_yaxes(title_text="金額 (円)", row=1, col=1)
+            fig.update_yaxes(title_text="昨対比 (%)", row=2, col=1)
+            
+            st.session_state[state_key] = fig
+        
+        x = monthly_data['売上年月']
+        with fig.batch_update():
+            fig.data[0].update(x=x, y=monthly_data['売上金額'])
+            fig.data[1].update(x=x, y=monthly_data['粗利金額'])
+            fig.data[2].update(x=x, y=monthly_data['昨対比_売上'])
+            fig.data[3].update(x=x, y=monthly_data['昨対比_粗利'])
+            fig.layout.title.text = title
+            fig.layout.annotations[0].text = subplot_title
+        
+        return fig
+    
     @staticmethod
     def format_currency(value: float) -> str:
         """通貨形式でフォーマットする"""
@@ -163,6 +466,24 @@ class ChartManager:
     def format_percentage(value: float) -> str:
         """パーセンテージ形式でフォーマットする"""
         return f"{value:.1f}%"
+    
+    @staticmethod
+    def currency_column_config(columns: List[str]) -> Dict[str, Any]:
+        """金額列をブラウザ側で通貨表示（¥1,234の桁区切り付き）するための列設定を作成する"""
+        return {col: st.column_config.NumberColumn(col, format="yen") for col in columns}
+    
+    @staticmethod
+    def create_detail_table(df: pd.DataFrame, max_rows: int) -> None:
+        """詳細データを新しい順に最大max_rows件まで表示する"""
+        if len(df) > max_rows:
+            st.caption(f"全{len(df):,}件中、新しい順に{max_rows:,}件を表示しています")
+        
+        st.dataframe(
+            df.nlargest(max_rows, '売上年月'),
+            use_container_width=True,
+            hide_index=True,
+            column_config=ChartManager.currency_column_config(['売上金額', '仕入れ金額', '粗利金額'])
+        )
 
 class ConfigManager:
     """設定管理クラス"""
@@ -180,6 +501,54 @@ class ConfigManager:
         """LLM URLを取得する"""
         return os.getenv("LLM_URL", "https://api.openai.com")
     
+    @staticmethod
+    @st.cache_resource
+    def get_openai_client(api_key: Optional[str]):
+        """OpenAIクライアントを作成し、接続プールごと全セッションで共有する"""
+        import httpx
+        import openai
+        
+        return openai.OpenAI(
+            api_key=api_key,
+            timeout=120.0,
+            http_client=httpx.Client(
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=100)
+            )
+        )
+    
+    @staticmethod
+    @st.cache_resource
+    def get_http_session(retry: bool = True):
+        """OpenAI互換のローカルLLMサーバー向けのrequestsセッションを全セッションで共有する（接続を使い回す）
+        
+        retry=Falseのセッションは再試行しない（/healthの確認など、すぐに結果が欲しい場合に使う）。
+        """
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        
+        if retry:
+            # 混雑・一時的な障害の応答だけを間隔を空けて再試行する（接続できない場合は待たずに失敗させる）
+            # チャット補完のPOSTは冪等ではないため、サーバーが処理前に断ったことが確実な429/503だけを対象にする
+            # （502/504はサーバー側で生成・課金が済んだ後に返ることがあり、再送すると二重に実行される）
+            max_retries = Retry(
+                total=3,
+                connect=0,
+                read=0,
+                backoff_factor=1,
+                status_forcelist=[429, 503],
+                allowed_methods=None,
+                respect_retry_after_header=True,
+                raise_on_status=False
+            )
+        else:
+            max_retries = 0
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=max_retries)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+    
     @staticmethod
     def validate_config() -> Dict[str, Any]:
         """設定の妥当性を検証する"""
@@ -194,5 +563,69 @@ class ConfigManager:
         
         return config_status
 
+@st.cache_resource(show_spinner=False)
+def _load_sales_data(csv_path: str) -> pd.DataFrame:
+    """CSVのパスごとに読み込み結果を全ページ・全セッションで共有する"""
+    return DataManager(csv_path)._read_data()
+
+@st.cache_resource
+def _load_cube(csv_path: str) -> pd.DataFrame:
+    """CSVのパスごとに集計キューブを作成し、共有する"""
+    df = _load_sales_data(csv_path)
+    if df.empty:
+        return df
+    
+    return df.groupby(
+        ['売上年月', '担当者', '商品名', '顧客名'], observed=True, as_index=False
+    )[['売上金額', '粗利金額']].sum()
+
+@st.cache_resource
+def _load_monthly(csv_path: str, group_column: str) -> pd.DataFrame:
+    """CSVのパスと列ごとに月次集計を作成し、共有する"""
+    df = _load_sales_data(csv_path)
+    if df.empty:
+        return df
+    
+    return df.groupby(
+        [group_column, '売上年月'], observed=True
+    )[['売上金額', '粗利金額']].sum().sort_index()
+
+@st.cache_resource
+def _load_partitioned(csv_path: str, group_column: str) -> tuple:
+    """CSVのパスと列ごとに並べ替え済みデータと値ごとの行範囲を作成し、共有する"""
+    df = _load_sales_data(csv_path)
+    if df.empty:
+        return df, {}
+    
+    # 年月順のデータを安定ソートするため、各値の中では年月順が保たれる
+    codes = df[group_column].cat.codes.to_numpy()
+    order = np.argsort(codes, kind='stable')
+    sorted_df = df.take(order).reset_index(drop=True)
+    
+    categories = df[group_column].cat.categories
+    bounds = np.searchsorted(codes[order], np.arange(len(categories) + 1))
+    slices = {value: slice(bounds[i], bounds[i + 1]) for i, value in enumerate(categories)}
+    return sorted_df, slices
+
+@st.cache_resource(max_entries=64)
+def _filter_data(csv_path: str,
+                 date_range: Optional[tuple],
+                 selected_staff: Optional[str],
+                 selected_product: Optional[str],
+                 selected_customer: Optional[str],
+                 use_cube: bool) -> pd.DataFrame:
+    """CSVのパスとフィルター条件ごとの抽出結果をキャッシュする"""
+    source = _load_cube(csv_path) if use_cube else _load_sales_data(csv_path)
+    return FilterManager.apply_filters(
+        source, date_range, selected_staff, selected_product, selected_customer
+    )
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _export_csv(csv_path: str, _df: pd.DataFrame, cache_key: tuple) -> bytes:
+    """CSVのパスとcache_keyごとにCSVエクスポート用のバイト列を作成する"""
+    buffer = io.BytesIO()
+    _df.to_csv(buffer, index=False, encoding='utf-8-sig')
+    return buffer.getvalue()
+
 # グローバルインスタンス
 data_manager = DataManager() 
\ No newline at end of file